@@ -1,5 +1,6 @@
 #!python
 import math
+import contextlib
 from collections import OrderedDict
 
 import numpy as np
@@ -7,35 +8,17 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 from asr.utils import params as p
-from asr.utils.misc import onehot2int, int2onehot, Swish, InferenceBatchSoftmax, register_nan_checks
+from asr.utils.misc import Swish, InferenceBatchSoftmax, register_nan_checks
 from asr.utils.logger import logger
 
 
-class SequenceWise(nn.Module):
-
-    def __init__(self, module):
-        """
-        Collapses input of dim T*N*H to (T*N)*H, and applies to a module.
-        Allows handling of variable sequence lengths and minibatch sizes.
-        :param module: Module to apply input to.
-        """
-        super().__init__()
-        self.module = module
-
-    def forward(self, x, *args, **kwargs):
-        t, n = x.size(0), x.size(1)
-        x = x.contiguous().view(t * n, -1)
-        x = self.module(x, *args, **kwargs)
-        x = x.contiguous().view(t, n, -1)
-        return x
-
-    def __repr__(self):
-        tmpstr = self.__class__.__name__ + ' (\n'
-        tmpstr += self.module.__repr__()
-        tmpstr += ')'
-        return tmpstr
+def get_len_mask(seq_lens, max_len, device):
+    "boolean mask of BxT, True on the valid steps of each sequence"
+    seq_lens = seq_lens.to(device, non_blocking=True)
+    return torch.arange(max_len, device=device)[None, :] < seq_lens[:, None]
 
 
 class Listener(nn.Module):
@@ -58,20 +41,24 @@ class Listener(nn.Module):
         C3 = C2 * 2
         H0 = C3 * W3
 
+        # conv -> bn -> relu -> pool, so that each bn can be folded into its conv for inference
+        # (see fuse_feature); models trained with the previous order need to be retrained
         self.feature = nn.Sequential(OrderedDict([
             ('cv1', nn.Conv2d(C0, C1, kernel_size=(11, 3), stride=(1, 1), padding=(5, 1), bias=True)),
+            ('bn1', nn.BatchNorm2d(C1)),
             ('nl1', nn.LeakyReLU()),
             ('mp1', nn.AvgPool2d(kernel_size=(3, 1), stride=(2, 1), padding=(1, 0))),
-            ('bn1', nn.BatchNorm2d(C1)),
             ('cv2', nn.Conv2d(C1, C2, kernel_size=(11, 3), stride=(1, 1), padding=(5, 1), bias=True)),
+            ('bn2', nn.BatchNorm2d(C2)),
             ('nl2', nn.LeakyReLU()),
             ('mp2', nn.AvgPool2d(kernel_size=(3, 1), stride=(2, 1), padding=(1, 0))),
-            ('bn2', nn.BatchNorm2d(C2)),
             ('cv3', nn.Conv2d(C2, C3, kernel_size=(11, 3), stride=(1, 1), padding=(5, 1), bias=True)),
+            ('bn3', nn.BatchNorm2d(C3)),
             ('nl3', nn.LeakyReLU()),
             ('mp3', nn.AvgPool2d(kernel_size=(3, 1), stride=(2, 1), padding=(1, 0))),
-            ('bn3', nn.BatchNorm2d(C3)),
         ]))
+        # NHWC convolutions run faster on tensor cores
+        self.feature = self.feature.to(memory_format=torch.channels_last)
 
         # using multi-layered nn.LSTM
         self.batch_first = True
@@ -79,21 +66,35 @@ class Listener(nn.Module):
                              bias=True, bidirectional=bidirectional, batch_first=self.batch_first)
 
         if last_fc:
-            self.fc = SequenceWise(nn.Sequential(OrderedDict([
+            self.fc = nn.Sequential(OrderedDict([
                 ('fc1', nn.Linear(rnn_hidden_size, listen_vec_size, bias=False)),
                 ('nl1', nn.LeakyReLU()),
                 ('ln1', nn.LayerNorm(listen_vec_size, elementwise_affine=False)),
-            ])))
+            ]))
         else:
             assert listen_vec_size == rnn_hidden_size
             self.fc = None
 
+    def fuse_feature(self):
+        """ fold each BatchNorm2d into its preceding Conv2d, only for inference """
+        assert not self.training
+        for i in range(1, 4):
+            cv, bn = getattr(self.feature, f'cv{i}'), getattr(self.feature, f'bn{i}')
+            if isinstance(bn, nn.BatchNorm2d):
+                setattr(self.feature, f'cv{i}', fuse_conv_bn_eval(cv, bn))
+                setattr(self.feature, f'bn{i}', nn.Identity())
+        self.feature = self.feature.to(memory_format=torch.channels_last)
+
     def forward(self, x, seq_lens):
-        h = self.feature(x)
+        h = self.feature(x.contiguous(memory_format=torch.channels_last))
+        h = h.contiguous()  # back to NCHW for collapsing
         h = h.view(-1, h.size(1) * h.size(2), h.size(3))  # Collapse feature dimension
         y = h.transpose(1, 2).contiguous()  # NxTxH
 
-        ps = nn.utils.rnn.pack_padded_sequence(y, seq_lens.tolist(), batch_first=self.batch_first)
+        # the reverse direction must not run over the padded frames, so the input stays packed;
+        # lengths are consumed on cpu as int64, so pass them as a tensor rather than a list
+        lengths = seq_lens.to('cpu', torch.int64, non_blocking=True)
+        ps = nn.utils.rnn.pack_padded_sequence(y, lengths, batch_first=self.batch_first, enforce_sorted=False)
         ps, _ = self.rnns(ps)
         y, _ = nn.utils.rnn.pad_packed_sequence(ps, batch_first=self.batch_first)
 
@@ -107,24 +108,18 @@ class Listener(nn.Module):
 
 class MaskedSoftmax(nn.Module):
 
-    def __init__(self, dim=-1, epsilon=1e-5):
+    def __init__(self, dim=-1):
         super().__init__()
         self.dim = dim
-        self.epsilon = epsilon
-
-        self.softmax = nn.Softmax(dim=dim)
 
     def forward(self, e, mask=None):
-        # e: Bx1xTh, mask: BxTh
+        # e: BxheadsxTh, mask: Bx1xTh (bool, True on the valid frames)
         if mask is None:
-            return self.softmax(e)
+            return F.softmax(e, dim=self.dim)
         else:
             # masked softmax only in input_seq_len in batch
-            # for stability, refered to https://eli.thegreenplace.net/2016/the-softmax-function-and-its-derivative/
-            shift_e = e - e.max()
-            exps = torch.exp(shift_e) * mask
-            sums = exps.sum(dim=self.dim, keepdim=True) + self.epsilon
-            return (exps / sums)
+            # filling the masked scores lets softmax use the per-row max for stability
+            return F.softmax(e.masked_fill(~mask, -1e4), dim=self.dim)
 
 
 class Attention(nn.Module):
@@ -145,34 +140,49 @@ class Attention(nn.Module):
             input_size = listen_vec_size * num_heads
             self.reduce = nn.Linear(input_size, listen_vec_size, bias=True)
 
-        self.normal = SequenceWise(MaskedSoftmax(dim=-1))
+        self.normal = MaskedSoftmax(dim=-1)
+        # fused attention kernel (no explicit score matrix), available from pytorch 2.0
+        self.fused = hasattr(F, 'scaled_dot_product_attention')
 
     def score(self, m, n):
         """ dot product as score function """
         return torch.bmm(m, n.transpose(1, 2))
 
-    def forward(self, s, h, len_mask=None):
-        # s: Bx1xHs -> m: Bx1xHe
-        # h: BxThxHh -> n: BxThxHe
-        if self.apply_proj:
-            m = self.phi(s)
-            n = self.psi(h)
-        else:
-            m = s
-            n = h
-
-        # <m, n> -> a, e: Bx1xTh -> c: Bx1xHh
-        if self.num_heads > 1:
-            proj_hidden_size = m.size(-1) // self.num_heads
-            ee = [self.score(mi, n) for mi in torch.split(m, proj_hidden_size, dim=-1)]
-            aa = [self.normal(e, len_mask) for e in ee]
-            c = self.reduce(torch.cat([torch.bmm(a, h) for a in aa], dim=-1))
-            a = torch.stack(aa).transpose(0, 1)
-        else:
+    def attention_precompute(self, h):
+        # h: BxThxHh -> n: BxThxHe, which is invariant over the decoding steps
+        return self.psi(h) if self.apply_proj else h
+
+    def forward(self, s, h, len_mask=None, need_weights=True):
+        n = self.attention_precompute(h)
+        return self.forward_with_n(s, h, n, len_mask, need_weights)
+
+    def forward_with_n(self, s, h, n, len_mask=None, need_weights=True):
+        # s: Bx1xHs -> m: Bx1x(heads*He) -> BxheadsxHe, one query row per head
+        # h: BxThxHh, n: BxThxHe
+        m = self.phi(s) if self.apply_proj else s
+        batch_size = m.size(0)
+        m = m.view(batch_size, self.num_heads, -1)
+
+        # <m, n> -> e, a: BxheadsxTh -> c: BxheadsxHh
+        if need_weights or not self.fused:
+            # len_mask: BxTh -> Bx1xTh to broadcast over the heads
+            mask = None if len_mask is None else len_mask[:, None, :]
             e = self.score(m, n)
-            a = self.normal(e, len_mask)
+            a = self.normal(e, mask)
             c = torch.bmm(a, h)
-            a = a.unsqueeze(dim=1)
+            a = a.unsqueeze(2)
+        else:
+            # fused kernel does not return the attention weights; pre-scaling m cancels
+            # its default 1/sqrt(He) scaling, since the scale kwarg needs pytorch 2.1
+            m = m * math.sqrt(m.size(-1))
+            # len_mask: BxTh -> Bx1x1xTh to broadcast over the heads
+            mask = None if len_mask is None else len_mask[:, None, None, :]
+            c = F.scaled_dot_product_attention(m.unsqueeze(1), n.unsqueeze(1), h.unsqueeze(1), attn_mask=mask)
+            c = c.squeeze(1)
+            a = None
+        c = c.reshape(batch_size, 1, -1)
+        if self.num_heads > 1:
+            c = self.reduce(c)
         # c: context (Bx1xHh), a: Bxheadsx1xTh
         return c, a
 
@@ -204,26 +214,35 @@ class MultiHeadedSelfAttention(nn.Module):
         self.scores = None # for visualization
         self.n_heads = num_heads
 
-    def forward(self, q, k, mask):
+    def forward(self, q, k, mask, need_weights=False):
         """
         x, q(query), k(key), v(value) : (B(batch_size), S(seq_len), D(dim))
         mask : (B(batch_size) x S(seq_len))
         * split D(dim) into (H(n_heads), W(width of head)) ; D = H * W
+        * the scores are kept for visualization only if need_weights is set
         """
         # (B, S, D) -proj-> (B, S, D) -split-> (B, S, H, W) -trans-> (B, H, S, W)
         q, k, v = self.proj_q(q), self.proj_k(k), self.proj_v(k)
         q, k, v = (split_last(x, (self.n_heads, -1)).transpose(1, 2) for x in [q, k, v])
-        # (B, H, S, W) @ (B, H, W, S) -> (B, H, S, S) -softmax-> (B, H, S, S)
-        scores = q @ k.transpose(-2, -1) / np.sqrt(k.size(-1))
         if mask is not None:
-            mask = mask[:, None, None, :].float()
-            scores -= 10000.0 * (1.0 - mask)
-        scores = self.drop(F.softmax(scores, dim=-1))
-        # (B, H, S, S) @ (B, H, S, W) -> (B, H, S, W) -trans-> (B, S, H, W)
-        h = (scores @ v).transpose(1, 2).contiguous()
-        # -merge-> (B, S, D)
+            mask = mask[:, None, None, :].bool()
+        if need_weights or not hasattr(F, 'scaled_dot_product_attention'):
+            # (B, H, S, W) @ (B, H, W, S) -> (B, H, S, S) -softmax-> (B, H, S, S)
+            scores = q @ k.transpose(-2, -1) / np.sqrt(k.size(-1))
+            if mask is not None:
+                scores = scores.masked_fill(~mask, -10000.0)
+            scores = self.drop(F.softmax(scores, dim=-1))
+            # (B, H, S, S) @ (B, H, S, W) -> (B, H, S, W)
+            h = scores @ v
+            self.scores = scores
+        else:
+            # fused kernel without materializing the (B, H, S, S) scores
+            dropout_p = self.drop.p if self.training else 0.
+            h = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout_p)
+            self.scores = None
+        # (B, H, S, W) -trans-> (B, S, H, W) -merge-> (B, S, D)
+        h = h.transpose(1, 2).contiguous()
         h = merge_last(h, 2)
-        self.scores = scores
         return h
 
 
@@ -243,8 +262,15 @@ class Speller(nn.Module):
         self.eos = label_vec_size - 1 if eos is None else eos
         self.max_seq_lens = max_seq_lens
         self.num_eos = 3
+        self.term_check_steps = 8
         self.tfr = 1.
 
+        # derived from sos/eos, so kept out of the state_dict (not persistent)
+        sos_onehot = F.one_hot(torch.tensor([[self.sos]]), num_classes=label_vec_size).float()
+        eos_onehot = F.one_hot(torch.tensor([[self.eos]]), num_classes=label_vec_size).float()
+        self.register_buffer('sos_onehot', sos_onehot, persistent=False)
+        self.register_buffer('eos_onehot', eos_onehot, persistent=False)
+
         Hs, Hc, Hy = rnn_hidden_size, listen_vec_size, label_vec_size
 
         self.rnn_num_layers = rnn_num_layers
@@ -262,66 +288,81 @@ class Speller(nn.Module):
             ('fc2', nn.Linear(128, label_vec_size, bias=False)),
         ]))
 
-        self.softmax = nn.Softmax(dim=-1)
-
     def get_mask(self, h, seq_lens):
-        bs, ts, hs = h.size()
-        mask = h.new_ones((bs, ts), dtype=torch.float)
-        for b in range(bs):
-            mask[b, seq_lens[b]:] = 0.
-        return mask
+        return get_len_mask(seq_lens, h.size(1), h.device)
 
     def _is_sample_step(self):
         return np.random.random_sample() < self.tfr
 
-    def forward(self, h, x_seq_lens, y=None, y_seq_lens=None):
+    def forward(self, h, x_seq_lens, y=None, y_seq_lens=None, need_weights=True):
         batch_size = h.size(0)
-        sos = int2onehot(h.new_full((batch_size, 1), self.sos), num_classes=self.label_vec_size).float()
-        eos = int2onehot(h.new_full((batch_size, 1), self.eos), num_classes=self.label_vec_size).float()
+        sos = self.sos_onehot.expand(batch_size, 1, -1)
+        eos = self.eos_onehot.expand(batch_size, 1, -1)
 
         hidden = None
-        y_hats = list()
-        attentions = list()
 
+        # mask and attention keys are invariant over the decoding steps
         in_mask = self.get_mask(h, x_seq_lens) if self.masked_attend else None
-        x = torch.cat([sos, h.narrow(1, 0, 1)], dim=-1)
+        n = self.attention.attention_precompute(h)
+
+        # without autograd, the outputs are written into preallocated buffers at each step;
+        # with autograd, every slice write would copy a full-buffer gradient in backward,
+        # so the steps are collected in lists and concatenated once
+        preallocate = not torch.is_grad_enabled()
+        if preallocate:
+            y_hats = h.new_empty((batch_size, self.max_seq_lens, self.label_vec_size))
+            if need_weights:
+                attentions = h.new_empty((batch_size, self.attention.num_heads, self.max_seq_lens, h.size(1)))
+        else:
+            y_hats, attentions = list(), list()
 
-        y_hats_seq_lens = torch.ones((batch_size, ), dtype=torch.int) * self.max_seq_lens
+        x = torch.cat([sos, h.narrow(1, 0, 1)], dim=-1)
 
-        bi = torch.zeros((self.num_eos, batch_size, )).byte()
-        if x.is_cuda:
-            bi = bi.cuda()
+        # keep the decoding states on device to avoid host syncs in the loop
+        y_hats_seq_lens = h.new_full((batch_size, ), self.max_seq_lens, dtype=torch.int)
+        eos_streak = h.new_zeros((batch_size, ), dtype=torch.int)
 
         for t in range(self.max_seq_lens):
             s, hidden = self.rnns(x, hidden)
             s = self.norm(s)
-            c, a = self.attention(s, h, in_mask)
-            y_hat = self.chardist(torch.cat([s, c], dim=-1))
-            y_hat = self.softmax(y_hat)
-
-            y_hats.append(y_hat)
-            attentions.append(a)
-
-            # check 3 conjecutive eos occurrences
-            bi[t % self.num_eos] = onehot2int(y_hat.squeeze()).eq(self.eos)
-            ri = y_hats_seq_lens.gt(t)
-            if bi.is_cuda:
-                ri = ri.cuda()
-            y_hats_seq_lens[bi.prod(dim=0, dtype=torch.uint8) * ri] = t + 1
-
-            # early termination
-            if y_hats_seq_lens.le(t + 1).all():
+            c, a = self.attention.forward_with_n(s, h, n, in_mask, need_weights)
+            if need_weights:
+                if preallocate:
+                    attentions[:, :, t:t+1] = a
+                else:
+                    attentions.append(a)
+            logits = self.chardist(torch.cat([s, c], dim=-1))
+
+            if preallocate:
+                y_hats[:, t:t+1] = logits
+            else:
+                y_hats.append(logits)
+
+            # check 3 conjecutive eos occurrences, counting the current eos streak
+            # argmax is invariant under softmax
+            eos_hit = logits.argmax(dim=-1).squeeze(1).eq(self.eos)
+            eos_streak = (eos_streak + 1) * eos_hit
+            done = eos_streak.ge(self.num_eos) & y_hats_seq_lens.gt(t)
+            y_hats_seq_lens.masked_fill_(done, t + 1)
+
+            # early termination, checked every term_check_steps since it syncs with host
+            if t % self.term_check_steps == self.term_check_steps - 1 and \
+               bool(y_hats_seq_lens.le(t + 1).all()):
                 break
 
             if y is None or not self._is_sample_step():     # non sampling step
-                x = torch.cat([y_hat, c], dim=-1)
+                x = torch.cat([F.softmax(logits, dim=-1), c], dim=-1)
             elif t < y.size(1):                             # scheduled sampling step
                 x = torch.cat([y.narrow(1, t, 1), c], dim=-1)
             else:
                 x = torch.cat([eos, c], dim=-1)
 
-        y_hats = torch.cat(y_hats, dim=1)
-        attentions = torch.cat(attentions, dim=2)
+        if preallocate:
+            y_hats = y_hats[:, :t+1]
+            attentions = attentions[:, :, :t+1] if need_weights else None
+        else:
+            y_hats = torch.cat(y_hats, dim=1)
+            attentions = torch.cat(attentions, dim=2) if need_weights else None
 
         return y_hats, y_hats_seq_lens, attentions
 
@@ -364,6 +405,15 @@ class TFRScheduler(object):
         self.model.tfr = self.get_tfr()
 
 
+@torch.jit.script
+def _log_with_label_smoothing(x, floor: float):
+    # log((1 - floor) * softmax(x) + floor / V), kept in log space from the logits
+    y = F.log_softmax(x, dim=-1)
+    if floor > 0.:
+        y = torch.logaddexp(y + math.log(1. - floor), y.new_full([1], math.log(floor / x.size(-1))))
+    return y
+
+
 class LogWithLabelSmoothing(nn.Module):
 
     def __init__(self, floor=0.01):
@@ -371,14 +421,14 @@ class LogWithLabelSmoothing(nn.Module):
         self.floor = floor
 
     def forward(self, x):
-        y = (1.0 - self.floor) * x + self.floor / x.size(-1)
-        return y.log()
+        # keep the log in fp32 under autocast
+        return _log_with_label_smoothing(x.float(), self.floor)
 
 
 class ListenAttendSpell(nn.Module):
 
     def __init__(self, label_vec_size=p.NUM_CTC_LABELS, listen_vec_size=256,
-                 state_vec_size=256, num_attend_heads=4, input_folding=2, smoothing=0.001):
+                 state_vec_size=256, num_attend_heads=4, input_folding=2, smoothing=0.001, bf16=False):
         super().__init__()
 
         self.label_vec_size = label_vec_size + 2  # to add <sos>, <eos>
@@ -401,12 +451,18 @@ class ListenAttendSpell(nn.Module):
         self.regions = None
         self.log = LogWithLabelSmoothing(floor=smoothing)
 
+        # opt-in bf16 autocast in training, see init_bf16() in train.py
+        self.bf16 = bf16
+
     def forward(self, x, x_seq_lens, y=None, y_seq_lens=None):
-        if self.training:
-            assert y is not None and y_seq_lens is not None
-            return self._train_forward(x, x_seq_lens, y, y_seq_lens)
-        else:
-            return self._eval_forward(x, x_seq_lens)
+        # torch.autocast is only touched when bf16 is on, so older pytorch still runs
+        use_bf16 = self.training and self.bf16 and x.is_cuda
+        with torch.autocast('cuda', dtype=torch.bfloat16) if use_bf16 else contextlib.nullcontext():
+            if self.training:
+                assert y is not None and y_seq_lens is not None
+                return self._train_forward(x, x_seq_lens, y, y_seq_lens)
+            else:
+                return self._eval_forward(x, x_seq_lens)
 
     def _train_forward(self, x, x_seq_lens, y, y_seq_lens):
         # to remove the case of x_seq_lens < y_seq_lens and y_seq_lens > max_seq_lens
@@ -419,42 +475,55 @@ class ListenAttendSpell(nn.Module):
         h = self.listen(x, x_seq_lens)
 
         # make ys from y including trailing eos
-        eos_t = y.new_full((self.spell.num_eos, ), self.eos)
-        ys = [torch.cat((yb, eos_t)) for yb in torch.split(y, y_seq_lens.tolist())]
-        ys = nn.utils.rnn.pad_sequence(ys, batch_first=True, padding_value=self.blank)
+        num_eos = self.spell.num_eos
+        max_len = int(y_seq_lens.max()) + num_eos
+        lens = y_seq_lens.to(y.device, non_blocking=True)[:, None]
+        pos = torch.arange(max_len, device=y.device)[None, :]
+        ys = y.new_full((y_seq_lens.size(0), max_len), self.blank)
+        ys.masked_scatter_(pos < lens, y)
+        ys.masked_fill_((pos >= lens) & (pos < lens + num_eos), self.eos)
         ys, ys_seq_lens = ys[bi], y_seq_lens[bi] + self.spell.num_eos
 
         floor = np.random.random_sample() * 0.1
-        yss = int2onehot(ys, num_classes=self.label_vec_size, floor=floor).float()
-        noise = torch.rand_like(yss) * 0.1
-        yss = F.softmax(yss * noise, dim=-1)
+        yss = F.one_hot(ys.long(), num_classes=self.label_vec_size).float()
+        yss = yss * (1. - floor) + floor / self.label_vec_size
         y_hats, y_hats_seq_lens, self.attentions = self.spell(h, x_seq_lens, yss, ys_seq_lens)
 
         # add regions to attentions
-        self.regions = torch.IntTensor([(frames - 1, labels - 1) for frames, labels in zip(x_seq_lens, ys_seq_lens)])
+        self.regions = torch.stack([x_seq_lens.sub(1), ys_seq_lens.sub(1)], dim=1).to(torch.int32)
+
+        y_hats = self.log(y_hats)
+
+        # the steps past the decoded length still have label and eos targets, since ys can run
+        # past it; log(floor / V) on every class keeps their loss the same as the previous smoothed
+        # blank one-hot padding, which gave it to all non-blank classes
+        floor = self.log.floor
+        log_floor = math.log(floor / self.label_vec_size) if floor > 0. else -math.inf
+
+        # the Speller checks for termination only every term_check_steps, so it can decode a few
+        # steps past the point where all samples ended; fill those like the padding, so that the
+        # loss does not depend on where the check falls
+        steps = torch.arange(y_hats.size(1), device=y_hats.device)
+        y_hats = y_hats.masked_fill((steps >= y_hats_seq_lens.max())[None, :, None], log_floor)
 
         # match seq lens between y_hats and ys
         s1, s2 = y_hats.size(1), ys.size(1)
         if s1 < s2:
-            dummy = y_hats.new_full((y_hats.size(0), s2 - s1, ), fill_value=self.blank, dtype=torch.int)
-            dummy = int2onehot(dummy, num_classes=self.label_vec_size).float()
-            y_hats = torch.cat([y_hats, dummy], dim=1)
-            #y_hats = F.pad(y_hats, (0, 0, 0, s2 - s1))
+            y_hats = F.pad(y_hats, (0, 0, 0, s2 - s1), value=log_floor)
         elif s1 > s2:
             ys = F.pad(ys, (0, s1 - s2), value=self.blank)
 
-        y_hats = self.log(y_hats)
         return y_hats, y_hats_seq_lens, ys, ys_seq_lens
 
     def _eval_forward(self, x, x_seq_lens):
         # listen
         h = self.listen(x, x_seq_lens)
         # spell
-        y_hats, y_hats_seq_lens, _ = self.spell(h, x_seq_lens)
+        y_hats, y_hats_seq_lens, _ = self.spell(h, x_seq_lens, need_weights=False)
         y_hats_seq_lens[y_hats_seq_lens.ne(self.spell.max_seq_lens)].sub_(self.spell.num_eos)
 
         # return with seq lens without sos and eos
-        y_hats = self.log(y_hats[:, :, :-2])
+        y_hats = self.log(y_hats)[:, :, :-2]
         return y_hats, y_hats_seq_lens
 
 
@@ -47,6 +47,9 @@ def predict(argv):
     input_folding = 3
     model = ListenAttendSpell(label_vec_size=p.NUM_CTC_LABELS, input_folding=input_folding)
     predictor = LASPredictor(model, **vars(args))
+    # fold the batchnorms into the convolutions once the weights are loaded
+    model.eval()
+    model.listen.fuse_feature()
 
     dataset = NonSplitPredictDataset(wav_files=args.wav_files, stride=input_folding)
     dataloader = NonSplitPredictDataLoader(dataset=dataset, sort=True, batch_size=args.batch_size,
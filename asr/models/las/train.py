@@ -118,6 +118,18 @@ class LASTrainer(NonSplitTrainer):
         self.states["tfr_scheduler"] = self.tfr_scheduler.state_dict()
 
 
+def init_bf16(args):
+    # bf16 autocast needs Ampere or later, and is not stacked on top of apex fp16
+    args.bf16 = args.bf16 and args.use_cuda and not args.fp16 and \
+                hasattr(torch.cuda, 'is_bf16_supported') and torch.cuda.is_bf16_supported()
+    if args.bf16:
+        # TF32 flags are process-wide, so they are set only for bf16 training runs;
+        # cudnn.benchmark stays off since T varies per batch, which would thrash its cache
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    return args.bf16
+
+
 def batch_train(argv):
     parser = argparse.ArgumentParser(description="ListenAttendSpell AM with batch training")
     # for training
@@ -128,6 +140,7 @@ def batch_train(argv):
     # optional
     parser.add_argument('--use-cuda', default=False, action='store_true', help="use cuda")
     parser.add_argument('--fp16', default=False, action='store_true', help="use FP16 model")
+    parser.add_argument('--bf16', default=False, action='store_true', help="use bf16 autocast and TF32 in training (Ampere or later, ignored with --fp16)")
     parser.add_argument('--visdom', default=False, action='store_true', help="use visdom logging")
     parser.add_argument('--visdom-host', default="127.0.0.1", type=str, help="visdom server ip address")
     parser.add_argument('--visdom-port', default=8097, type=int, help="visdom server port")
@@ -148,7 +161,8 @@ def batch_train(argv):
 
     # prepare trainer object
     input_folding = 3
-    model = ListenAttendSpell(label_vec_size=p.NUM_CTC_LABELS, input_folding=input_folding)
+    model = ListenAttendSpell(label_vec_size=p.NUM_CTC_LABELS, input_folding=input_folding,
+                              bf16=init_bf16(args))
 
     amp_handle = get_amp_handle(args)
     trainer = LASTrainer(model, amp_handle, **vars(args))
@@ -248,6 +262,7 @@ def train(argv):
     # optional
     parser.add_argument('--use-cuda', default=False, action='store_true', help="use cuda")
     parser.add_argument('--fp16', default=False, action='store_true', help="use FP16 model")
+    parser.add_argument('--bf16', default=False, action='store_true', help="use bf16 autocast and TF32 in training (Ampere or later, ignored with --fp16)")
     parser.add_argument('--visdom', default=False, action='store_true', help="use visdom logging")
     parser.add_argument('--visdom-host', default="127.0.0.1", type=str, help="visdom server ip address")
     parser.add_argument('--visdom-port', default=8097, type=int, help="visdom server port")
@@ -268,7 +283,8 @@ def train(argv):
 
     # prepare trainer object
     input_folding = 3
-    model = ListenAttendSpell(label_vec_size=p.NUM_CTC_LABELS, input_folding=input_folding)
+    model = ListenAttendSpell(label_vec_size=p.NUM_CTC_LABELS, input_folding=input_folding,
+                              bf16=init_bf16(args))
 
     amp_handle = get_amp_handle(args)
     trainer = LASTrainer(model, amp_handle, **vars(args))
@@ -45,7 +45,7 @@ class NonSplitPredictor:
                 # no need to normalize posteriors with state priors when we use CTC
                 # https://static.googleusercontent.com/media/research.google.com/en//pubs/archive/43908.pdf
                 if self.use_cuda:
-                    ys_hat = ys_hat.cpu()
+                    ys_hat, frame_lens = ys_hat.cpu(), frame_lens.cpu()
                 words, alignment, w_sizes, a_sizes = self.decoder(ys_hat, frame_lens)
                 # print results
                 ys_hat = [y[:s] for y, s in zip(ys_hat, frame_lens)]
@@ -98,7 +98,7 @@ class SplitPredictor(NonSplitPredictor):
                 ys_hat = torch.cat(ys_hats).transpose(1, 2)
                 # latgen decoding
                 if self.use_cuda:
-                    ys_hat = ys_hat.cpu()
+                    ys_hat, frame_lens = ys_hat.cpu(), frame_lens.cpu()
                 words, alignment, w_sizes, a_sizes = self.decoder(ys_hat, frame_lens)
                 # print results
                 ys_hat = [y[:s] for y, s in zip(ys_hat, frame_lens)]